@@ -11,6 +11,16 @@ Authors
 """
 
 import torch
+import functools
+
+# torch.linalg.solve_triangular is only available from torch 1.11
+if hasattr(torch.linalg, "solve_triangular"):
+    _solve_triangular = torch.linalg.solve_triangular
+else:
+
+    def _solve_triangular(A, B, upper):
+        """Solves AX = B for X, where A is triangular."""
+        return torch.triangular_solve(B, A, upper=upper)[0]
 
 
 def gevd(a, b=None):
@@ -25,6 +35,9 @@ def gevd(a, b=None):
     The eigenvalues returned by the method (ds) are stored in a tensor
     with the following format (*,C,C,2).
 
+    Half precision inputs (float16 or bfloat16) are decomposed in single
+    precision and the results are returned in the input precision.
+
     Arguments
     ---------
     a : tensor
@@ -74,44 +87,43 @@ def gevd(a, b=None):
     P = a.shape[D - 1]
     C = int(round(((1 + 8 * P) ** 0.5 - 1) / 2))
 
-    # Converting the input matrices to block matrices
-    ash = f(a)
+    # Cholesky and eigh are not available in half precision
+    dtype = a.dtype
+    if dtype in [torch.float16, torch.bfloat16]:
+        a = a.float()
+        if b is not None:
+            b = b.float()
+
+    # Converting the input matrices to full complex matrices
+    acs = h(a)
 
     if b is None:
 
         b = torch.zeros(a.shape, dtype=a.dtype, device=a.device)
-        ids = torch.triu_indices(C, C)
-        b[..., 0, ids[0] == ids[1]] = 1.0
+        _, ids_diag = _triu_indices(C, a.device)
+        b[..., 0, ids_diag] = 1.0
 
-    bsh = f(b)
+    bcs = h(b)
 
     # Performing the Cholesky decomposition
-    lsh = torch.linalg.cholesky(bsh)
-    lsh_inv = torch.inverse(lsh)
-    lsh_inv_T = torch.transpose(lsh_inv, D - 2, D - 1)
+    lcs = torch.linalg.cholesky(bcs)
+    lcs_H = torch.transpose(lcs, D - 2, D - 1).conj()
 
-    # Computing the matrix C
-    csh = torch.matmul(lsh_inv, torch.matmul(ash, lsh_inv_T))
+    # Computing the matrix C = L^-1 A L^-H with triangular solves
+    tcs = _solve_triangular(lcs, acs, upper=False)
+    tcs_H = torch.transpose(tcs, D - 2, D - 1).conj()
+    ccs = _solve_triangular(lcs, tcs_H, upper=False)
 
     # Performing the eigenvalue decomposition
-    es, ysh = torch.linalg.eigh(csh, UPLO="U")
+    es, ycs = torch.linalg.eigh(ccs, UPLO="U")
 
     # Collecting the eigenvalues
-    dsh = torch.zeros(
-        a.shape[slice(0, D - 2)] + (2 * C, 2 * C),
-        dtype=a.dtype,
-        device=a.device,
-    )
-    dsh[..., range(0, 2 * C), range(0, 2 * C)] = es
+    ds = torch.view_as_real(torch.diag_embed(es.to(ycs.dtype)))
 
-    # Collecting the eigenvectors
-    vsh = torch.matmul(lsh_inv_T, ysh)
-
-    # Converting the block matrices to full complex matrices
-    vs = ginv(vsh)
-    ds = ginv(dsh)
+    # Collecting the eigenvectors V = L^-H Y
+    vs = torch.view_as_real(_solve_triangular(lcs_H, ycs, upper=True))
 
-    return vs, ds
+    return vs.to(dtype), ds.to(dtype)
 
 
 def svdl(a):
@@ -154,11 +166,6 @@ def svdl(a):
     >>> us, ds = svdl(XXs)
     """
 
-    # Dimensions
-    D = a.dim()
-    P = a.shape[D - 1]
-    C = int(round(((1 + 8 * P) ** 0.5 - 1) / 2))
-
     # Computing As * As_T
     ash = f(a)
     ash_T = torch.transpose(ash, -2, -1)
@@ -169,8 +176,7 @@ def svdl(a):
     es, ush = torch.linalg.eigh(ash_mm_ash_T, UPLO="U")
 
     # Collecting the eigenvalues
-    dsh = torch.zeros(ush.shape, dtype=es.dtype, device=es.device)
-    dsh[..., range(0, 2 * C), range(0, 2 * C)] = torch.sqrt(es)
+    dsh = torch.diag_embed(torch.sqrt(es))
 
     # Converting the block matrices to full complex matrices
     us = ginv(ush)
@@ -197,27 +203,47 @@ def f(ws):
 
     # Dimensions
     D = ws.dim()
-    ws = ws.transpose(D - 2, D - 1)
-    P = ws.shape[D - 2]
+    P = ws.shape[D - 1]
     C = int(round(((1 + 8 * P) ** 0.5 - 1) / 2))
 
-    # Output matrix
-    wsh = torch.zeros(
-        ws.shape[0 : (D - 2)] + (2 * C, 2 * C),
-        dtype=ws.dtype,
-        device=ws.device,
-    )
+    # Output matrix, every element is picked from (real, imag, -imag)
+    values = torch.cat((ws[..., 0, :], ws[..., 1, :], -1 * ws[..., 1, :]), -1)
+    wsh = values[..., _f_index(C, ws.device)]
+
+    return wsh.view(ws.shape[0 : (D - 2)] + (2 * C, 2 * C))
+
+
+@functools.lru_cache(maxsize=None)
+def _f_index(C, device):
+    """Returns, for each element of the flattened (2C,2C) block matrix built
+    by f, its index in the concatenated (real, imag, -imag) parts of the
+    upper triangular input.
+
+    Arguments
+    ---------
+    C : int
+        The number of channels.
+    device : torch.device
+        The device the index is placed on.
+    """
+
+    P = int(C * (C + 1) / 2)
     ids = torch.triu_indices(C, C)
-    wsh[..., ids[1] * 2, ids[0] * 2] = ws[..., 0]
-    wsh[..., ids[0] * 2, ids[1] * 2] = ws[..., 0]
-    wsh[..., ids[1] * 2 + 1, ids[0] * 2 + 1] = ws[..., 0]
-    wsh[..., ids[0] * 2 + 1, ids[1] * 2 + 1] = ws[..., 0]
-    wsh[..., ids[0] * 2, ids[1] * 2 + 1] = -1 * ws[..., 1]
-    wsh[..., ids[1] * 2 + 1, ids[0] * 2] = -1 * ws[..., 1]
-    wsh[..., ids[0] * 2 + 1, ids[1] * 2] = ws[..., 1]
-    wsh[..., ids[1] * 2, ids[0] * 2 + 1] = ws[..., 1]
+    re = torch.arange(P)
+    im = re + P
+    neg_im = re + 2 * P
 
-    return wsh
+    index = torch.zeros((2 * C, 2 * C), dtype=torch.long)
+    index[ids[1] * 2, ids[0] * 2] = re
+    index[ids[0] * 2, ids[1] * 2] = re
+    index[ids[1] * 2 + 1, ids[0] * 2 + 1] = re
+    index[ids[0] * 2 + 1, ids[1] * 2 + 1] = re
+    index[ids[0] * 2, ids[1] * 2 + 1] = neg_im
+    index[ids[1] * 2 + 1, ids[0] * 2] = neg_im
+    index[ids[0] * 2 + 1, ids[1] * 2] = im
+    index[ids[1] * 2, ids[0] * 2 + 1] = im
+
+    return index.view(-1).to(device)
 
 
 def finv(wsh):
@@ -238,15 +264,16 @@ def finv(wsh):
     # Dimensions
     D = wsh.dim()
     C = int(wsh.shape[D - 1] / 2)
-    P = int(C * (C + 1) / 2)
 
     # Output matrix
-    ws = torch.zeros(
-        wsh.shape[0 : (D - 2)] + (2, P), dtype=wsh.dtype, device=wsh.device
+    ids, _ = _triu_indices(C, wsh.device)
+    ws = torch.stack(
+        (
+            wsh[..., ids[0] * 2, ids[1] * 2],
+            -1 * wsh[..., ids[0] * 2, ids[1] * 2 + 1],
+        ),
+        D - 2,
     )
-    ids = torch.triu_indices(C, C)
-    ws[..., 0, :] = wsh[..., ids[0] * 2, ids[1] * 2]
-    ws[..., 1, :] = -1 * wsh[..., ids[0] * 2, ids[1] * 2 + 1]
 
     return ws
 
@@ -269,18 +296,19 @@ def g(ws):
     D = ws.dim()
     C = ws.shape[D - 2]
 
-    # Output matrix
-    wsh = torch.zeros(
-        ws.shape[0 : (D - 3)] + (2 * C, 2 * C),
-        dtype=ws.dtype,
-        device=ws.device,
+    # Output matrix, built as (*,C,2,C,2) where each complex element
+    # becomes the 2x2 block [[re, -im], [im, re]]
+    ws_re = ws[..., 0]
+    ws_im = ws[..., 1]
+    wsh = torch.stack(
+        (
+            torch.stack((ws_re, -1 * ws_im), D - 1),
+            torch.stack((ws_im, ws_re), D - 1),
+        ),
+        D - 2,
     )
-    wsh[..., slice(0, 2 * C, 2), slice(0, 2 * C, 2)] = ws[..., 0]
-    wsh[..., slice(1, 2 * C, 2), slice(1, 2 * C, 2)] = ws[..., 0]
-    wsh[..., slice(0, 2 * C, 2), slice(1, 2 * C, 2)] = -1 * ws[..., 1]
-    wsh[..., slice(1, 2 * C, 2), slice(0, 2 * C, 2)] = ws[..., 1]
 
-    return wsh
+    return wsh.view(ws.shape[0 : (D - 3)] + (2 * C, 2 * C))
 
 
 def ginv(wsh):
@@ -302,16 +330,50 @@ def ginv(wsh):
     D = wsh.dim()
     C = int(wsh.shape[D - 1] / 2)
 
-    # Output matrix
-    ws = torch.zeros(
-        wsh.shape[0 : (D - 2)] + (C, C, 2), dtype=wsh.dtype, device=wsh.device
+    # Output matrix, the real and imaginary parts are copied at once
+    ws = torch.stack(
+        (
+            wsh[..., slice(0, 2 * C, 2), slice(0, 2 * C, 2)],
+            wsh[..., slice(1, 2 * C, 2), slice(0, 2 * C, 2)],
+        ),
+        D,
     )
-    ws[..., 0] = wsh[..., slice(0, 2 * C, 2), slice(0, 2 * C, 2)]
-    ws[..., 1] = wsh[..., slice(1, 2 * C, 2), slice(0, 2 * C, 2)]
 
     return ws
 
 
+def h(ws):
+    """Transform 3.
+
+    This method takes a complex Hermitian matrix represented by its
+    upper triangular part and converts it to the full matrix, stored
+    as a complex tensor. The output tensor will have the following
+    format: (*,C,C)
+
+    Arguments
+    ---------
+    ws : tensor
+        An input matrix. The tensor must have the following format:
+        (*,2,C+P)
+    """
+
+    # Dimensions
+    D = ws.dim()
+    P = ws.shape[D - 1]
+    C = int(round(((1 + 8 * P) ** 0.5 - 1) / 2))
+
+    # Output matrix
+    wss = torch.complex(ws[..., 0, :], ws[..., 1, :])
+    wsh = torch.empty(
+        ws.shape[0 : (D - 2)] + (C, C), dtype=wss.dtype, device=ws.device,
+    )
+    ids, _ = _triu_indices(C, ws.device)
+    wsh[..., ids[1], ids[0]] = wss.conj()
+    wsh[..., ids[0], ids[1]] = wss
+
+    return wsh
+
+
 def pos_def(ws, alpha=0.001, eps=1e-20):
     """Diagonal modification.
 
@@ -340,16 +402,13 @@ def pos_def(ws, alpha=0.001, eps=1e-20):
     C = int(round(((1 + 8 * P) ** 0.5 - 1) / 2))
 
     # Finding the indices of the diagonal
-    ids_triu = torch.triu_indices(C, C)
-    ids_diag = torch.eq(ids_triu[0, :], ids_triu[1, :])
+    _, ids_diag = _triu_indices(C, ws.device)
 
     # Computing the trace
-    trace = torch.sum(ws[..., 0, ids_diag], D - 2)
-    trace = trace.view(trace.shape + (1,))
-    trace = trace.repeat((1,) * (D - 2) + (C,))
+    trace = torch.sum(ws[..., 0, ids_diag], D - 2, keepdim=True)
 
     # Adding the trace multiplied by alpha to the diagonal
-    ws_pf = ws.clone()
+    ws_pf = ws.clone(memory_format=torch.contiguous_format)
     ws_pf[..., 0, ids_diag] += alpha * trace + eps
 
     return ws_pf
@@ -392,27 +451,34 @@ def inv(x):
     >>> XXs_inv = inv(XXs)
     """
 
-    # Dimensions
-    d = x.dim()
-    p = x.shape[-1]
-    n_channels = int(round(((1 + 8 * p) ** 0.5 - 1) / 2))
+    # Output matrix, inverted from its Cholesky factor as L^-H L^-1
+    xs = h(pos_def(x))
+    ls = torch.linalg.cholesky(xs)
+    eye = torch.eye(ls.shape[-1], dtype=ls.dtype, device=ls.device)
+    ls_inv = _solve_triangular(ls, eye.expand_as(ls), upper=False)
+    x_inv = torch.view_as_real(
+        torch.matmul(ls_inv.conj().transpose(-2, -1), ls_inv)
+    )
 
-    # Output matrix
-    ash = f(pos_def(x))
-    ash_inv = torch.inverse(ash)
-    as_inv = finv(ash_inv)
+    return x_inv
 
-    indices = torch.triu_indices(n_channels, n_channels)
 
-    x_inv = torch.zeros(
-        x.shape[slice(0, d - 2)] + (n_channels, n_channels, 2),
-        dtype=x.dtype,
-        device=x.device,
-    )
+@functools.lru_cache(maxsize=None)
+def _triu_indices(C, device):
+    """Returns the indices of the upper triangular part of a (C,C) matrix,
+    in the order used by the (*,2,C+P) format, and the mask selecting the
+    diagonal among them. Both are cached per number of channels and
+    device, so they must not be modified.
+
+    Arguments
+    ---------
+    C : int
+        The number of channels.
+    device : torch.device
+        The device the indices are placed on.
+    """
 
-    x_inv[..., indices[1], indices[0], 0] = as_inv[..., 0, :]
-    x_inv[..., indices[1], indices[0], 1] = -1 * as_inv[..., 1, :]
-    x_inv[..., indices[0], indices[1], 0] = as_inv[..., 0, :]
-    x_inv[..., indices[0], indices[1], 1] = as_inv[..., 1, :]
+    ids = torch.triu_indices(C, C, device=device)
+    ids_diag = torch.eq(ids[0, :], ids[1, :])
 
-    return x_inv
+    return ids, ids_diag
@@ -8,8 +8,10 @@ Authors
  * Samuele Cornell 2020
 """
 import torch
+import torch.fft as fft
 import math
-from packaging import version
+import functools
+from scipy.fft import next_fast_len
 
 
 def compute_amplitude(waveforms, lengths=None, amp_type="avg", scale="linear"):
@@ -49,10 +51,11 @@ def compute_amplitude(waveforms, lengths=None, amp_type="avg", scale="linear"):
 
     if amp_type == "avg":
         if lengths is None:
-            out = torch.mean(torch.abs(waveforms), dim=1, keepdim=True)
-        else:
-            wav_sum = torch.sum(input=torch.abs(waveforms), dim=1, keepdim=True)
-            out = wav_sum / lengths
+            lengths = waveforms.shape[1]
+
+        # The L1 norm sums absolute values without storing them
+        wav_sum = torch.norm(waveforms, p=1, dim=1, keepdim=True)
+        out = wav_sum / lengths
     elif amp_type == "peak":
         out = torch.max(torch.abs(waveforms), dim=1, keepdim=True)[0]
     else:
@@ -162,15 +165,18 @@ def convolve1d(
     groups=1,
     use_fft=False,
     rotation_index=0,
+    method="auto",
+    channels_first=False,
 ):
     """Use torch.nn.functional to perform 1d padding and conv.
 
     Arguments
     ---------
     waveform : tensor
-        The tensor to perform operations on.
+        The tensor to perform operations on, `[batch, time, channels]`.
     kernel : tensor
-        The filter to apply during convolution.
+        The filter to apply during convolution,
+        `[out_channels, time, in_channels / groups]`.
     padding : int or tuple
         The padding (pad_left, pad_right) to apply.
         If an integer is passed instead, this is passed
@@ -193,8 +199,21 @@ def convolve1d(
         difference in the case of reverberation, but may make more difference
         with different kernels.
     rotation_index : int
-        This option only applies if `use_fft` is true. If so, the kernel is
-        rolled by this amount before convolution to shift the output location.
+        This option only applies if `use_fft` is true. If so, the kernel,
+        zero-padded to the signal length, is circularly rolled left by this
+        many samples (modulo the signal length; negative values roll right)
+        before convolution to shift the output location.
+    method : str
+        This option only applies if `use_fft` is false. One of "direct",
+        "fft" or "auto". With "direct", `conv1d` is used. With "fft", the same
+        (non-circular) result is computed in the spectral domain. With "auto",
+        the cheaper of the two is picked from an estimate of their cost. FFT
+        is typically faster for kernels longer than about 500 samples.
+    channels_first : bool
+        If True, `waveform` and `kernel` have the channels before time,
+        as expected by `torch.nn.functional.conv1d`, and so does the output.
+        This avoids transposing back and forth, which for multi-channel
+        inputs can cost a copy of the waveform.
 
     Returns
     -------
@@ -207,73 +226,189 @@ def convolve1d(
     >>> signal = signal.unsqueeze(0).unsqueeze(2)
     >>> kernel = torch.rand(1, 10, 1)
     >>> signal = convolve1d(signal, kernel, padding=(9, 0))
+    >>> signal = convolve1d(
+    ...     signal.transpose(1, 2), kernel.transpose(1, 2), channels_first=True
+    ... )
+    >>> signal.shape
+    torch.Size([1, 1, 52164])
     """
     if len(waveform.shape) != 3:
         raise ValueError("Convolve1D expects a 3-dimensional tensor")
 
     # Move time dimension last, which pad and fft and conv expect.
-    waveform = waveform.transpose(2, 1)
-    kernel = kernel.transpose(2, 1)
+    if not channels_first:
+        waveform = waveform.transpose(2, 1)
+        kernel = kernel.transpose(2, 1)
 
     # Padding can be a tuple (left_pad, right_pad) or an int
+    out_slice = slice(None)
     if isinstance(padding, tuple):
-        waveform = torch.nn.functional.pad(
-            input=waveform, pad=padding, mode=pad_type,
-        )
+        left_pad, right_pad = padding
+        offset = max(padding) - left_pad
+
+        # Zero padding is left to conv with the largest of the two sizes,
+        # outputs due to extra padding on the other side are cut afterwards.
+        # Kernels longer than the padded input are padded explicitly, so
+        # that the error raised by conv reports the requested size.
+        length = waveform.size(-1) + left_pad + right_pad
+        if (
+            not use_fft
+            and pad_type == "constant"
+            and offset % stride == 0
+            and length >= kernel.size(-1)
+        ):
+            out_length = (length - kernel.size(-1)) // stride + 1
+            out_slice = slice(offset // stride, offset // stride + out_length)
+            padding = max(padding)
+        else:
+            waveform = torch.nn.functional.pad(
+                input=waveform, pad=padding, mode=pad_type,
+            )
+            padding = 0
 
     # This approach uses FFT, which is more efficient if the kernel is large
     if use_fft:
 
-        # Pad kernel to same length as signal, ensuring correct alignment
-        zero_length = waveform.size(-1) - kernel.size(-1)
-
-        # Handle case where signal is shorter
-        if zero_length < 0:
-            kernel = kernel[..., :zero_length]
-            zero_length = 0
+        # Kernel is zero-padded or cut to the length of the signal by rfft
+        length = waveform.size(-1)
+        f_signal = fft.rfft(waveform)
+        f_kernel = fft.rfft(kernel, n=length)
 
-        # Perform rotation to ensure alignment
-        zeros = torch.zeros(
-            kernel.size(0), kernel.size(1), zero_length, device=kernel.device
-        )
-        after_index = kernel[..., rotation_index:]
-        before_index = kernel[..., :rotation_index]
-        kernel = torch.cat((after_index, zeros, before_index), dim=-1)
+        # Perform rotation to ensure alignment, as a phase shift
+        rotation_index = int(rotation_index)
+        if rotation_index != 0:
+            freqs = torch.arange(f_kernel.size(-1), device=kernel.device)
+            phase = (freqs * rotation_index % length).to(kernel.dtype)
+            f_kernel = f_kernel * torch.exp(2j * math.pi / length * phase)
 
         # Multiply in frequency domain to convolve in time domain
-        if version.parse(torch.__version__) > version.parse("1.6.0"):
-            import torch.fft as fft
+        convolved = fft.irfft(f_signal * f_kernel, n=length)
 
-            result = fft.rfft(waveform) * fft.rfft(kernel)
-            convolved = fft.irfft(result, n=waveform.size(-1))
-        else:
-            f_signal = torch.rfft(waveform, 1)
-            f_kernel = torch.rfft(kernel, 1)
-            sig_real, sig_imag = f_signal.unbind(-1)
-            ker_real, ker_imag = f_kernel.unbind(-1)
-            f_result = torch.stack(
-                [
-                    sig_real * ker_real - sig_imag * ker_imag,
-                    sig_real * ker_imag + sig_imag * ker_real,
-                ],
-                dim=-1,
+    else:
+        if method == "auto":
+            method = _choose_conv_method(
+                waveform, kernel, padding, stride, groups
+            )
+
+        # Same result as conv1d, more efficient if the kernel is large
+        if method == "fft":
+            convolved = _fft_conv1d(waveform, kernel, padding, stride, groups)
+
+        # Use the implementation given by torch, which should be efficient on GPU
+        elif method == "direct":
+            convolved = torch.nn.functional.conv1d(
+                input=waveform,
+                weight=kernel,
+                stride=stride,
+                groups=groups,
+                padding=padding,
             )
-            convolved = torch.irfft(
-                f_result, 1, signal_sizes=[waveform.size(-1)]
+        else:
+            raise ValueError(
+                "method must be one of 'auto', 'direct' or 'fft', got %s"
+                % method
             )
 
-    # Use the implementation given by torch, which should be efficient on GPU
-    else:
-        convolved = torch.nn.functional.conv1d(
-            input=waveform,
-            weight=kernel,
-            stride=stride,
-            groups=groups,
-            padding=padding if not isinstance(padding, tuple) else 0,
-        )
+        convolved = convolved[..., out_slice]
 
     # Return time dimension to the second dimension.
-    return convolved.transpose(2, 1)
+    if not channels_first:
+        convolved = convolved.transpose(2, 1)
+
+    return convolved
+
+
+def _choose_conv_method(waveform, kernel, padding=0, stride=1, groups=1):
+    """Returns "direct" or "fft", whichever is estimated to be cheaper for
+    the `conv1d` of `waveform` with `kernel`.
+
+    The direct cost is the number of multiply-adds of the convolution, which
+    only computes every `stride`-th output. The FFT cost counts three
+    transforms at the fast length `_fft_conv1d` pads the signal to (similar
+    to `scipy.signal.choose_conv_method`), which computes all the outputs
+    regardless of the stride. The factor between the two was measured on
+    CPU and puts the crossover around 500 samples for kernels applied to a
+    few seconds of audio with stride 1.
+
+    Arguments
+    ---------
+    waveform : tensor
+        Input of shape [batch, in_channels, time].
+    kernel : tensor
+        Filters of shape [out_channels, in_channels / groups, kernel_size].
+    padding : int
+        Zero padding added to both sides of the input.
+    stride : int
+        The number of units to move each time convolution is applied.
+    groups : int
+        Number of groups the input channels are split into.
+    """
+    if waveform.dtype not in [torch.float32, torch.float64]:
+        return "direct"
+
+    length = waveform.size(-1) + 2 * padding
+    kernel_size = kernel.size(-1)
+    in_channels = waveform.size(1)
+    out_channels = kernel.size(0)
+    if kernel_size > length:
+        return "direct"
+
+    fft_length = next_fast_len(length, real=True)
+
+    out_length = (length - kernel_size) // stride + 1
+    direct_cost = out_length * kernel_size * in_channels * out_channels / groups
+    fft_cost = (
+        3 * fft_length * math.log2(fft_length) * max(in_channels, out_channels)
+    )
+
+    return "direct" if direct_cost < fft_cost * 10 else "fft"
+
+
+def _fft_conv1d(waveform, kernel, padding=0, stride=1, groups=1):
+    """Computes the same cross-correlation as `torch.nn.functional.conv1d`
+    by multiplying in the frequency domain.
+
+    Arguments
+    ---------
+    waveform : tensor
+        Input of shape [batch, in_channels, time].
+    kernel : tensor
+        Filters of shape [out_channels, in_channels / groups, kernel_size].
+    padding : int
+        Zero padding added to both sides of the input.
+    stride : int
+        The number of units to move each time convolution is applied.
+    groups : int
+        Number of groups the input channels are split into.
+    """
+    if padding > 0:
+        waveform = torch.nn.functional.pad(waveform, (padding, padding))
+    if kernel.size(-1) > waveform.size(-1):
+        raise ValueError(
+            "Kernel size (%d) can't be greater than padded input size (%d)"
+            % (kernel.size(-1), waveform.size(-1))
+        )
+
+    # Circular correlation does not wrap around for the valid output samples
+    # as long as the FFT is at least as long as the signal. Sizes with only
+    # small prime factors are much faster and make FFT plans reusable.
+    out_length = waveform.size(-1) - kernel.size(-1) + 1
+    length = next_fast_len(waveform.size(-1), real=True)
+    batch, in_channels = waveform.shape[:2]
+    out_channels = kernel.size(0)
+
+    f_signal = fft.rfft(waveform, n=length)
+    f_signal = f_signal.view(batch, groups, in_channels // groups, -1)
+    f_kernel = fft.rfft(kernel, n=length).conj()
+    f_kernel = f_kernel.view(
+        groups, out_channels // groups, in_channels // groups, -1
+    )
+
+    # Sum over the input channels of each group
+    f_result = torch.einsum("bgcf,gocf->bgof", f_signal, f_kernel)
+    convolved = fft.irfft(f_result.reshape(batch, out_channels, -1), n=length)
+
+    return convolved[..., :out_length:stride]
 
 
 def reverberate(waveforms, rir_waveform, rescale_amp="avg"):
@@ -356,7 +491,7 @@ def dB_to_amplitude(SNR):
 
     Arguments
     ---------
-    SNR : float
+    SNR : float or tensor
         The ratio in decibels to convert.
 
     Example
@@ -365,7 +500,13 @@ def dB_to_amplitude(SNR):
     3.162
     >>> dB_to_amplitude(SNR=0)
     1.0
+    >>> dB_to_amplitude(torch.tensor([0.0, 20.0]))
+    tensor([ 1., 10.])
     """
+    # For tensors, a single exp is cheaper than pow with base 10
+    if isinstance(SNR, torch.Tensor):
+        return torch.exp(SNR * (math.log(10) / 20))
+
     return 10 ** (SNR / 20)
 
 
@@ -394,6 +535,16 @@ def notch_filter(notch_freq, filter_width=101, notch_width=0.05):
     >>> kernel = notch_filter(0.25)
     >>> notched_signal = convolve1d(signal, kernel)
     """
+    # Filters only depend on the arguments, so they are cached. A copy is
+    # returned so that callers can modify it without altering the cache.
+    return _notch_filter(
+        float(notch_freq), int(filter_width), float(notch_width)
+    ).clone()
+
+
+@functools.lru_cache(maxsize=128)
+def _notch_filter(notch_freq, filter_width, notch_width):
+    """Computes the kernel returned by `notch_filter`."""
 
     # Check inputs
     assert 0 < notch_freq <= 1
@@ -404,27 +555,20 @@ def notch_filter(notch_freq, filter_width=101, notch_width=0.05):
     # Avoid frequencies that are too low
     notch_freq += notch_width
 
-    # Define sinc function, avoiding division by zero
-    def sinc(x):
-        def _sinc(x):
-            return torch.sin(x) / x
-
-        # The zero is at the middle index
-        return torch.cat([_sinc(x[:pad]), torch.ones(1), _sinc(x[pad + 1 :])])
-
-    # Compute a low-pass filter with cutoff frequency notch_freq.
-    hlpf = sinc(3 * (notch_freq - notch_width) * inputs)
-    hlpf *= torch.blackman_window(filter_width)
-    hlpf /= torch.sum(hlpf)
+    # Compute a low-pass and a high-pass filter with cutoff frequency
+    # notch_freq at once, one per row. The sinc is 1 where x is zero.
+    cutoffs = torch.tensor([notch_freq - notch_width, notch_freq + notch_width])
+    x = 3 * cutoffs.unsqueeze(1) * inputs
+    filters = torch.where(x == 0, torch.ones_like(x), torch.sin(x) / x)
+    filters *= torch.blackman_window(filter_width)
+    filters /= torch.sum(filters, dim=-1, keepdim=True)
 
-    # Compute a high-pass filter with cutoff frequency notch_freq.
-    hhpf = sinc(3 * (notch_freq + notch_width) * inputs)
-    hhpf *= torch.blackman_window(filter_width)
-    hhpf /= -torch.sum(hhpf)
-    hhpf[pad] += 1
+    # Adding filters creates notch filter (the high-pass is the inverted
+    # low-pass with the higher cutoff)
+    notch = filters[0] - filters[1]
+    notch[pad] += 1
 
-    # Adding filters creates notch filter
-    return (hlpf + hhpf).view(1, -1, 1)
+    return notch.view(1, -1, 1)
 
 
 def overlap_and_add(signal, frame_step):
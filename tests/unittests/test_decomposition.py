@@ -0,0 +1,70 @@
+import torch
+
+
+def test_gevd(device):
+
+    from speechbrain.processing.decomposition import gevd, pos_def
+
+    torch.manual_seed(0)
+    for n_channels in [1, 2, 4]:
+        ids = torch.triu_indices(n_channels, n_channels)
+
+        # Random complex covariance matrices, in the (*,2,C+P) format
+        xs = torch.randn((2, 3, 5, n_channels, 50, 2), device=device)
+        xs = torch.view_as_complex(xs)
+        xxs = torch.matmul(xs, xs.conj().transpose(-2, -1)) / 50
+        xxs = xxs[..., ids[0], ids[1]]
+        a = torch.stack((xxs[0].real, xxs[0].imag), -2)
+        b = pos_def(torch.stack((xxs[1].real, xxs[1].imag), -2))
+
+        vs, ds = gevd(a, b)
+
+        # Full complex matrices to check that AV = BVD
+        def full(ws):
+            wsh = torch.complex(ws[..., 0, :], ws[..., 1, :])
+            out = torch.zeros(
+                ws.shape[:-2] + (n_channels, n_channels),
+                dtype=wsh.dtype,
+                device=device,
+            )
+            out[..., ids[1], ids[0]] = wsh.conj()
+            out[..., ids[0], ids[1]] = wsh
+            return out
+
+        vs = torch.view_as_complex(vs.contiguous())
+        ds = torch.view_as_complex(ds.contiguous())
+        assert torch.allclose(
+            torch.matmul(full(a), vs),
+            torch.matmul(full(b), torch.matmul(vs, ds)),
+            atol=1e-4,
+        )
+
+        # Half precision inputs give results in the same precision
+        vs, ds = gevd(a.to(torch.bfloat16), b.to(torch.bfloat16))
+        assert vs.dtype == ds.dtype == torch.bfloat16
+
+
+def test_inv(device):
+
+    from speechbrain.processing.decomposition import inv, pos_def
+
+    torch.manual_seed(0)
+    for n_channels in [1, 2, 4]:
+        ids = torch.triu_indices(n_channels, n_channels)
+        xs = torch.randn((3, 5, n_channels, 50, 2), device=device)
+        xs = torch.view_as_complex(xs)
+        xxs = torch.matmul(xs, xs.conj().transpose(-2, -1)) / 50
+        a = torch.stack(
+            (xxs[..., ids[0], ids[1]].real, xxs[..., ids[0], ids[1]].imag), -2
+        )
+
+        # The inverse is computed on the diagonally loaded matrix
+        xxs_pd = pos_def(a)
+        xxs = torch.complex(xxs_pd[..., 0, :], xxs_pd[..., 1, :])
+        full = torch.zeros_like(xs[..., 0:n_channels])
+        full[..., ids[1], ids[0]] = xxs.conj()
+        full[..., ids[0], ids[1]] = xxs
+
+        a_inv = torch.view_as_complex(inv(a).contiguous())
+        eye = torch.eye(n_channels, dtype=full.dtype, device=device)
+        assert torch.allclose(torch.matmul(full, a_inv), eye, atol=1e-4)
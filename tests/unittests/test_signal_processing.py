@@ -1,3 +1,4 @@
+import pytest
 import torch
 
 
@@ -28,3 +29,110 @@ def test_normalize(device):
                 np.testing.assert_array_almost_equal(
                     scaled_back.cpu().numpy(), test_vec.cpu().numpy()
                 )
+
+
+def test_convolve1d_fft(device):
+
+    from speechbrain.processing.signal_processing import convolve1d
+
+    torch.manual_seed(0)
+    waveform = torch.randn((2, 1000, 4), device=device)
+    for kernel, groups in [
+        (torch.randn((4, 41, 1), device=device), 4),
+        (torch.randn((4, 41, 2), device=device), 2),
+        (torch.randn((3, 41, 4), device=device), 1),
+    ]:
+        for padding in [0, 20, (40, 0)]:
+            for stride in [1, 3]:
+                direct = convolve1d(
+                    waveform,
+                    kernel,
+                    padding=padding,
+                    stride=stride,
+                    groups=groups,
+                    method="direct",
+                )
+                spectral = convolve1d(
+                    waveform,
+                    kernel,
+                    padding=padding,
+                    stride=stride,
+                    groups=groups,
+                    method="fft",
+                )
+                assert direct.shape == spectral.shape
+                assert torch.allclose(direct, spectral, atol=1e-4)
+
+    # Kernels longer than the padded input fail with either method
+    waveform = torch.randn((1, 10, 1), device=device)
+    kernel = torch.randn((1, 20, 1), device=device)
+    with pytest.raises(RuntimeError):
+        convolve1d(waveform, kernel, method="direct")
+    with pytest.raises(ValueError):
+        convolve1d(waveform, kernel, method="fft")
+
+
+def test_convolve1d_padding(device):
+
+    from speechbrain.processing.signal_processing import convolve1d
+
+    torch.manual_seed(0)
+    waveform = torch.randn((2, 100, 1), device=device)
+    kernel = torch.randn((1, 9, 1), device=device)
+    for padding in [(4, 4), (8, 0), (0, 8), (3, 6), (6, 3)]:
+        for stride in [1, 2, 3]:
+            expected = torch.nn.functional.conv1d(
+                torch.nn.functional.pad(waveform.transpose(1, 2), padding),
+                kernel.transpose(1, 2),
+                stride=stride,
+            ).transpose(1, 2)
+            convolved = convolve1d(
+                waveform, kernel, padding=padding, stride=stride
+            )
+            assert convolved.shape == expected.shape
+            assert torch.allclose(convolved, expected, atol=1e-6)
+
+    # Errors for kernels that are too long report the requested padding
+    waveform = torch.randn((1, 2000, 1), device=device)
+    kernel = torch.randn((1, 2011, 1), device=device)
+    for method in ["direct", "fft"]:
+        with pytest.raises((RuntimeError, ValueError), match="2010"):
+            convolve1d(waveform, kernel, padding=(3, 7), method=method)
+
+
+def test_convolve1d_rotation(device):
+
+    from speechbrain.processing.signal_processing import convolve1d
+
+    torch.manual_seed(0)
+    waveform = torch.randn((2, 1000, 1), device=device)
+    kernel = torch.randn((1, 50, 1), device=device)
+    padded = torch.nn.functional.pad(kernel, (0, 0, 0, 950))
+
+    # The rotation is a circular roll of the padded kernel, for any index
+    for rotation_index in [3, -3, 70, 1003]:
+        rotated = convolve1d(
+            waveform, kernel, use_fft=True, rotation_index=rotation_index
+        )
+        rolled = convolve1d(
+            waveform, torch.roll(padded, -rotation_index, dims=1), use_fft=True,
+        )
+        assert torch.allclose(rotated, rolled, atol=1e-4)
+
+
+def test_convolve1d_method(device):
+
+    from speechbrain.processing.signal_processing import _choose_conv_method
+
+    waveform = torch.randn((8, 1, 48000), device=device)
+    kernel = torch.randn((1, 1, 1024), device=device)
+
+    # Long kernels are convolved with FFT, unless few outputs are needed
+    assert _choose_conv_method(waveform, kernel) == "fft"
+    assert _choose_conv_method(waveform, kernel, stride=160) == "direct"
+    assert _choose_conv_method(waveform, kernel[..., :31]) == "direct"
+
+    # Same outcome at a length that is not FFT friendly
+    waveform = torch.randn((8, 1, 48017), device=device)
+    assert _choose_conv_method(waveform, kernel) == "fft"
+    assert _choose_conv_method(waveform, kernel, stride=160) == "direct"